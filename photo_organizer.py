@@ -6,11 +6,19 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
-from collections.abc import Generator, Mapping, Sequence
+import collections
+from collections.abc import Callable, Generator, Iterable, Mapping, MutableMapping, Sequence
+import concurrent.futures
 import contextlib
+import ctypes
 import datetime
+import errno
+import filecmp
+import functools
 import glob
 import hashlib
+import json
+import mmap
 import os
 import pathlib
 import re
@@ -24,6 +32,42 @@ import zipfile
 
 import certifi
 import exiftool
+import xxhash
+
+MEDIA_SUFFIXES = frozenset({".jpeg", ".jpg", ".mov", ".png"})
+"""Lowercase suffixes of the files that are considered media files."""
+
+HASH_CHUNK_SIZE = 1 << 20
+"""Number of bytes read at once when hashing media files that are not memory-mapped."""
+
+HASH_READAHEAD_SIZE = 8 << 20
+"""Number of bytes of memory-mapped media files that are read ahead while hashing."""
+
+PARTIAL_HASH_SIZE = 4 << 20
+"""Number of bytes at the beginning of large media files that are hashed with ``--partial-hash``."""
+
+CREATION_DATETIME_TAGS = ["EXIF:DateTimeOriginal", "QuickTime:CreationDate"]
+"""Metadata tags containing the creation datetime of media files, in order of precedence."""
+
+METADATA_CHUNK_SIZE = 500
+"""Maximum number of media files passed to a single exiftool command."""
+
+METADATA_PREFETCH_COUNT = 4
+"""Maximum number of chunks for which exiftool retrieves metadata ahead of their processing."""
+
+DATETIME_PATTERN = re.compile(
+    r"(?P<year>\d+):(?P<month>\d+):(?P<day>\d+) (?P<hour>\d+):(?P<minute>\d+):(?P<second>\d+)"
+    r"((?P<timezone_sign>[+-])(?P<timezone_hour>\d+):(?P<timezone_minute>\d+))?",
+    flags=re.ASCII,
+)
+"""Pattern of datetimes in exiftool's output."""
+
+AT_FDCWD = -100
+"""Value of ``AT_FDCWD`` on Linux, which makes ``renameat2`` resolve relative paths against the
+current working directory."""
+
+RENAME_NOREPLACE = 1
+"""Flag of ``renameat2`` on Linux, which makes it fail if the new path already exists."""
 
 
 def main(string_arguments: Sequence[str] | None = None) -> None:
@@ -34,13 +78,23 @@ def main(string_arguments: Sequence[str] | None = None) -> None:
     arguments = parse_arguments(string_arguments)
     old_media_paths = collect_media_paths(arguments.glob_patterns)
     if len(old_media_paths) == 0: raise RuntimeError("No files match the given glob patterns.")
-    rename_dict = get_rename_dict(old_media_paths)
-    if len(rename_dict) == 0:
-        print("No renames to perform, exiting.")
-        return
-    if arguments.dry_run: return
-    if (not arguments.force) and (input("Continue [y/n]? ").lower() != "y"): return
-    rename(rename_dict)
+    with (
+        open_hash_cache(arguments.partial_hash, arguments.legacy_hash) if arguments.hash_cache
+        else contextlib.nullcontext()
+    ) as hash_cache:
+        if hash_cache is not None: prune_hash_cache(hash_cache, old_media_paths)
+        rename_dict = get_rename_dict(
+            old_media_paths,
+            hash_cache,
+            arguments.partial_hash,
+            arguments.legacy_hash,
+        )
+        if len(rename_dict) == 0:
+            print("No renames to perform, exiting.")
+            return
+        if arguments.dry_run: return
+        if (not arguments.force) and (input("Continue [y/n]? ").lower() != "y"): return
+        rename(rename_dict, hash_cache)
 
 
 def parse_arguments(string_arguments: Sequence[str] | None = None) -> argparse.Namespace:
@@ -52,9 +106,9 @@ def parse_arguments(string_arguments: Sequence[str] | None = None) -> argparse.N
         description="Rename photo and video files according to the timestamp they were taken. The "
         "format for the stems of the new filenames is `YYYY-MM-DD_HH-MM-SS_HASH`, where "
         "`YYYY-MM-DD_HH-MM-SS` is the time in local time when the file was created, and `HASH` is "
-        "the first 8 bytes of the SHA256 hash of the contents of the file. When run without any "
-        "arguments, all files in the current directory are processed (non-recursively), and the "
-        "user is asked for confirmation before renaming any files.",
+        "the first 8 hexadecimal digits of the XXH3 128-bit hash of the contents of the file. When "
+        "run without any arguments, all files in the current directory are processed "
+        "(non-recursively), and the user is asked for confirmation before renaming any files.",
     )
     argument_parser.add_argument(
         "-f",
@@ -68,6 +122,28 @@ def parse_arguments(string_arguments: Sequence[str] | None = None) -> argparse.N
         action=argparse.BooleanOptionalAction,
         help="Do not rename anything, just show what would be done.",
     )
+    argument_parser.add_argument(
+        "--hash-cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Cache the hashes of media files across runs, keyed by their paths, sizes, and "
+        "modification times. Enabled by default.",
+    )
+    argument_parser.add_argument(
+        "--partial-hash",
+        action=argparse.BooleanOptionalAction,
+        help="For files larger than 4 MiB, only hash the first 4 MiB and the file size instead of "
+        "the whole file. This is much faster for large videos, but the hashes of such files differ "
+        "from the ones without this option, and different files are more likely to get the same "
+        "name. Files are only removed as duplicates if their contents are identical.",
+    )
+    argument_parser.add_argument(
+        "--legacy-hash",
+        action=argparse.BooleanOptionalAction,
+        help="Use the SHA256 hash instead of the faster XXH3 128-bit hash, as in earlier versions "
+        "of photo_organizer. Use this to keep the names of files that have been renamed by such "
+        "versions.",
+    )
     argument_parser.add_argument(
         "glob_patterns",
         metavar="GLOB_PATTERN",
@@ -83,44 +159,122 @@ def collect_media_paths(glob_patterns: Sequence[str]) -> list[pathlib.Path]:
     """Collect paths of all media files matching the given glob patterns.
 
     :glob_patterns: Sequence of glob patterns to match ``**`` is supported.
-    :return: List of paths of media files (``.jpg``, ``.mov``, ``.png``) matching the glob patterns.
-    The paths are sorted for each glob pattern, but the paths of an earlier glob pattern appear
-    earlier in the list than the paths of a later glob pattern.
+    :return: List of paths of media files (with a suffix in ``MEDIA_SUFFIXES``) matching the glob
+    patterns. The paths are sorted for each glob pattern, but the paths of an earlier glob pattern
+    appear earlier in the list than the paths of a later glob pattern. Paths matching multiple glob
+    patterns only appear once, for the earliest of these glob patterns.
     """
     media_paths: list[pathlib.Path] = []
+    seen_media_paths: set[pathlib.Path] = set()
     for glob_pattern in glob_patterns:
-        media_paths.extend(sorted(
-            media_path
-            for path_string in glob.glob(glob_pattern, recursive=True)
-            if (media_path := pathlib.Path(path_string)).suffix.lower() in {".jpg", ".mov", ".png"}
-        ))
+        for media_path in sorted(
+            pathlib.Path(path_string)
+            for path_string in glob.iglob(glob_pattern, recursive=True)
+            if os.path.splitext(path_string)[1].lower() in MEDIA_SUFFIXES
+        ):
+            if media_path in seen_media_paths: continue
+            seen_media_paths.add(media_path)
+            media_paths.append(media_path)
     return media_paths
 
 
-def get_rename_dict(old_media_paths: Sequence[pathlib.Path]) -> dict[pathlib.Path, pathlib.Path]:
+def get_rename_dict(
+    old_media_paths: Sequence[pathlib.Path],
+    hash_cache: MutableMapping[str, str] | None = None,
+    partial_hash: bool = False,
+    legacy_hash: bool = False,
+) -> dict[pathlib.Path, pathlib.Path]:
     """Process media paths and return dict with mapping to new names.
 
+    The creation datetimes are determined from the metadata first, and only media files with a
+    creation datetime are hashed, so skipped files are never read.
+
     :param old_media_paths: Sequence of media paths before renaming.
+    :param hash_cache: Cache of hashes as yielded by :func:`open_hash_cache`, or ``None`` to always
+    compute hashes.
+    :param partial_hash: Whether to only hash the beginning of large files, see
+    :func:`compute_hash`.
+    :param legacy_hash: Whether to use SHA256 instead of XXH3, see :func:`compute_hash`.
     :return: Dict from old media paths to renamed media paths.
     """
+    print("Retrieving metadata of {} file{}...".format(
+        len(old_media_paths),
+        "" if len(old_media_paths) == 1 else "s",
+    ))
+    # Each stage is a generator that runs ahead of the next stage in background threads, so that
+    # exiftool, hashing, and formatting overlap. If the loop is interrupted, closing the generators
+    # shuts down their executors, so that no worker writes to the hash cache while it is written
+    # back.
+    rename_dict = {}
+    with contextlib.closing(compute_hashes(
+        get_creation_datetimes(old_media_paths),
+        hash_cache,
+        partial_hash,
+        legacy_hash,
+    )) as hashes:
+        for old_media_path, creation_datetime, hash_ in hashes:
+            new_media_path = format_media_path(old_media_path, creation_datetime, hash_)
+            if old_media_path == new_media_path: continue
+            print(f"Would rename `{old_media_path}` -> `{new_media_path}`.")
+            rename_dict[old_media_path] = new_media_path
+    return rename_dict
+
+
+def get_creation_datetimes(
+    media_paths: Sequence[pathlib.Path],
+) -> Generator[tuple[pathlib.Path, datetime.datetime], None, None]:
+    """Get creation datetimes of media files.
+
+    The metadata is retrieved with exiftool in chunks by a background thread, which runs ahead of
+    the consumer of the generator by at most ``METADATA_PREFETCH_COUNT`` chunks. The thread also
+    parses the creation datetimes, so only these and not the metadata are kept for pending chunks.
+
+    :param media_paths: Sequence of media paths.
+    :return: Generator yielding tuples of media paths and their creation datetimes as returned by
+    :func:`get_creation_datetime`, in the order of ``media_paths``. Media paths without creation
+    datetime are skipped.
+    """
     with contextlib.ExitStack() as exit_stack:
         if (sys.platform == "win32") and (shutil.which("exiftool.exe") is None):
             exit_stack.enter_context(download_exiftool_on_windows())
         exif_tool_helper = exit_stack.enter_context(exiftool.ExifToolHelper())
-        print("Retrieving metadata of {} file{}...".format(
-            len(old_media_paths),
-            "" if len(old_media_paths) == 1 else "s",
-        ))
-        metadata = exif_tool_helper.get_metadata(old_media_paths)
-    rename_dict = {}
-    for old_media_path, metadata_entry in zip(old_media_paths, metadata):
-        creation_datetime = get_creation_datetime(metadata_entry)
-        if creation_datetime is None: continue
-        new_media_path = format_media_path(old_media_path, creation_datetime)
-        if old_media_path == new_media_path: continue
-        print(f"Would rename `{old_media_path}` -> `{new_media_path}`.")
-        rename_dict[old_media_path] = new_media_path
-    return rename_dict
+        # The executor has only one worker, as exiftool can only process one command at a time.
+        executor = exit_stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=1))
+        creation_datetime_futures: collections.deque[
+            concurrent.futures.Future[list[tuple[pathlib.Path, datetime.datetime]]]
+        ] = collections.deque()
+        for chunk_start in range(0, len(media_paths), METADATA_CHUNK_SIZE):
+            creation_datetime_futures.append(executor.submit(
+                get_chunk_creation_datetimes,
+                exif_tool_helper,
+                media_paths[chunk_start:chunk_start + METADATA_CHUNK_SIZE],
+            ))
+            if len(creation_datetime_futures) > METADATA_PREFETCH_COUNT:
+                yield from creation_datetime_futures.popleft().result()
+        while len(creation_datetime_futures) > 0:
+            yield from creation_datetime_futures.popleft().result()
+
+
+def get_chunk_creation_datetimes(
+    exif_tool_helper: exiftool.ExifToolHelper,
+    media_paths: Sequence[pathlib.Path],
+) -> list[tuple[pathlib.Path, datetime.datetime]]:
+    """Get creation datetimes of a chunk of media files with a single exiftool command.
+
+    :param exif_tool_helper: Running exiftool instance.
+    :param media_paths: Sequence of media paths.
+    :return: List of tuples of media paths and their creation datetimes as returned by
+    :func:`get_creation_datetime`, in the order of ``media_paths``. Media paths without creation
+    datetime are skipped. The metadata returned by exiftool is discarded.
+    """
+    return [
+        (media_path, creation_datetime)
+        for media_path, metadata_entry in zip(
+            media_paths,
+            exif_tool_helper.get_tags(media_paths, CREATION_DATETIME_TAGS),
+        )
+        if (creation_datetime := get_creation_datetime(metadata_entry)) is not None
+    ]
 
 
 def get_creation_datetime(metadata: dict[str, Any]) -> datetime.datetime | None:
@@ -132,12 +286,7 @@ def get_creation_datetime(metadata: dict[str, Any]) -> datetime.datetime | None:
     """
     media_path = metadata["SourceFile"]
     assert isinstance(media_path, str)
-    datetime_pattern = re.compile(
-        r"(?P<year>\d+):(?P<month>\d+):(?P<day>\d+) (?P<hour>\d+):(?P<minute>\d+):(?P<second>\d+)"
-        r"((?P<timezone_sign>[+-])(?P<timezone_hour>\d+):(?P<timezone_minute>\d+))?",
-        flags=re.ASCII,
-    )
-    for metadata_key in ["EXIF:DateTimeOriginal", "QuickTime:CreationDate"]:
+    for metadata_key in CREATION_DATETIME_TAGS:
         if metadata_key in metadata:
             creation_datetime_string = metadata[metadata_key]
             assert isinstance(creation_datetime_string, str)
@@ -148,22 +297,33 @@ def get_creation_datetime(metadata: dict[str, Any]) -> datetime.datetime | None:
             file=sys.stderr,
         )
         return None
-    regex_match = datetime_pattern.fullmatch(creation_datetime_string)
-    if regex_match is None:
-        print(
-            f"Could not parse creation datetime `{creation_datetime_string}` of `{media_path}`, "
-            "skipping.",
-            file=sys.stderr,
+    regex_match = DATETIME_PATTERN.fullmatch(creation_datetime_string)
+    if regex_match is not None:
+        year, month, day, hour, minute, second = regex_match.group(
+            "year",
+            "month",
+            "day",
+            "hour",
+            "minute",
+            "second",
         )
-        return None
-    return datetime.datetime(
-        int(regex_match.group("year")),
-        int(regex_match.group("month")),
-        int(regex_match.group("day")),
-        int(regex_match.group("hour")),
-        int(regex_match.group("minute")),
-        int(regex_match.group("second")),
+        # This fails for invalid dates such as `0000:00:00 00:00:00`, which cameras write if their
+        # clock has not been set.
+        with contextlib.suppress(ValueError):
+            return datetime.datetime(
+                int(year),
+                int(month),
+                int(day),
+                int(hour),
+                int(minute),
+                int(second),
+            )
+    print(
+        f"Could not parse creation datetime `{creation_datetime_string}` of `{media_path}`, "
+        "skipping.",
+        file=sys.stderr,
     )
+    return None
 
 
 @contextlib.contextmanager
@@ -209,35 +369,264 @@ def download_exiftool_on_windows() -> Generator[pathlib.Path, None, None]:
             os.environ["PATH"] = original_path
 
 
+def get_cache_directory() -> pathlib.Path:
+    """Get directory for files that are kept across runs.
+
+    :return: Path of ``photo-organizer`` in ``%LOCALAPPDATA%`` on Windows and in
+    ``$XDG_CACHE_HOME`` (defaulting to ``~/.cache``) otherwise. The directory might not exist yet.
+    """
+    if sys.platform == "win32":
+        cache_root_directory = pathlib.Path(os.environ["LOCALAPPDATA"])
+    else:
+        cache_root_directory = pathlib.Path(
+            os.environ.get("XDG_CACHE_HOME") or (pathlib.Path.home() / ".cache")
+        )
+    return cache_root_directory / "photo-organizer"
+
+
+@contextlib.contextmanager
+def open_hash_cache(
+    partial_hash: bool = False,
+    legacy_hash: bool = False,
+) -> Generator[dict[str, str], None, None]:
+    """Load the cache of hashes of media files computed in previous runs.
+
+    :param partial_hash: Whether the cached hashes are computed with ``partial_hash`` (see
+    :func:`compute_hash`).
+    :param legacy_hash: Whether the cached hashes are computed with ``legacy_hash`` (see
+    :func:`compute_hash`).
+    :return: Generator yielding a dict from keys as returned by :func:`get_hash_cache_key` to
+    values as returned by :func:`get_hash_cache_value` once. When the generator resumes, the dict
+    is written back to ``hashes-HASH.json`` in the cache directory if it has been changed, where
+    ``HASH`` is ``xxh3`` or ``sha256``, followed by ``-partial`` if ``partial_hash`` is ``True``.
+    Hence, hashes of different kinds are cached in separate files.
+    """
+    try:
+        hash_cache_path = get_cache_directory() / "hashes-{}{}.json".format(
+            "sha256" if legacy_hash else "xxh3",
+            "-partial" if partial_hash else "",
+        )
+    except (KeyError, RuntimeError) as exception:
+        print(
+            f"Could not determine cache directory ({exception!r}), not caching hashes.",
+            file=sys.stderr,
+        )
+        yield {}
+        return
+    try:
+        original_hash_cache_string = hash_cache_path.read_text()
+        hash_cache = json.loads(original_hash_cache_string)
+    except (OSError, ValueError):
+        original_hash_cache_string = None
+        hash_cache = {}
+    if not isinstance(hash_cache, dict): hash_cache = {}
+    try:
+        yield hash_cache
+    finally:
+        hash_cache_string = json.dumps(hash_cache)
+        if hash_cache_string != original_hash_cache_string:
+            try:
+                hash_cache_path.parent.mkdir(parents=True, exist_ok=True)
+                temporary_hash_cache_path = hash_cache_path.with_suffix(".json.tmp")
+                temporary_hash_cache_path.write_text(hash_cache_string)
+                temporary_hash_cache_path.replace(hash_cache_path)
+            except OSError as exception:
+                print(
+                    f"Could not write hash cache to `{hash_cache_path}` ({exception}), skipping.",
+                    file=sys.stderr,
+                )
+
+
+def prune_hash_cache(
+    hash_cache: MutableMapping[str, str],
+    media_paths: Iterable[pathlib.Path],
+) -> None:
+    """Remove entries of deleted files from the hash cache.
+
+    Only entries in the directories of ``media_paths`` are checked, so that the cache does not have
+    to be compared with the whole file system.
+
+    :param hash_cache: Cache of hashes as yielded by :func:`open_hash_cache`.
+    :param media_paths: Media paths that are processed.
+    """
+    hash_cache_keys = {get_hash_cache_key(media_path) for media_path in media_paths}
+    directories = {os.path.dirname(hash_cache_key) for hash_cache_key in hash_cache_keys}
+    for hash_cache_key in list(hash_cache):
+        if (
+            (hash_cache_key not in hash_cache_keys)
+            and (os.path.dirname(hash_cache_key) in directories)
+            and (not os.path.exists(hash_cache_key))
+        ):
+            del hash_cache[hash_cache_key]
+
+
+def get_hash_cache_key(media_path: pathlib.Path) -> str:
+    """Get key of a media file in the hash cache.
+
+    :param media_path: Media path.
+    :return: Absolute path of the file. As the key does not depend on the contents of the file, an
+    edited file replaces its previous entry.
+    """
+    return str(media_path.absolute())
+
+
+def get_hash_cache_value(media_path: pathlib.Path, hash_: str) -> str:
+    """Get value of a media file in the hash cache.
+
+    :param media_path: Media path.
+    :param hash_: Hash of the contents of the file as returned by :func:`compute_hash`.
+    :return: Value of the form ``SIZE|MTIME|HASH``, where ``SIZE`` is the size of the file in bytes,
+    ``MTIME`` is its modification time in nanoseconds, and ``HASH`` is ``hash_``. The hash is only
+    valid as long as the size and the modification time are unchanged.
+    """
+    stat_result = media_path.stat()
+    return f"{stat_result.st_size}|{stat_result.st_mtime_ns}|{hash_}"
+
+
+def compute_hashes(
+    media_paths_and_datetimes: Iterable[tuple[pathlib.Path, datetime.datetime]],
+    hash_cache: MutableMapping[str, str] | None = None,
+    partial_hash: bool = False,
+    legacy_hash: bool = False,
+) -> Generator[tuple[pathlib.Path, datetime.datetime, str], None, None]:
+    """Compute hashes of the contents of media files in parallel.
+
+    The hashes are computed by a pool of background threads (hashing releases the GIL), which runs
+    ahead of the consumer of the generator by at most twice as many files as there are threads.
+
+    :param media_paths_and_datetimes: Iterable of tuples of media paths and creation datetimes as
+    yielded by :func:`get_creation_datetimes`.
+    :param hash_cache: Cache of hashes as yielded by :func:`open_hash_cache`, or ``None`` to always
+    compute hashes.
+    :param partial_hash: Whether to only hash the beginning of large files, see
+    :func:`compute_hash`.
+    :param legacy_hash: Whether to use SHA256 instead of XXH3, see :func:`compute_hash`.
+    :return: Generator yielding tuples of the media paths, the creation datetimes, and the hashes as
+    returned by :func:`compute_hash`, in the order of ``media_paths_and_datetimes``.
+    """
+    worker_count = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        hash_futures: collections.deque[
+            tuple[pathlib.Path, datetime.datetime, concurrent.futures.Future[str]]
+        ] = collections.deque()
+        for media_path, creation_datetime in media_paths_and_datetimes:
+            hash_futures.append((
+                media_path,
+                creation_datetime,
+                executor.submit(
+                    compute_hash,
+                    media_path,
+                    hash_cache,
+                    partial_hash,
+                    legacy_hash,
+                ),
+            ))
+            if len(hash_futures) > 2 * worker_count:
+                media_path, creation_datetime, hash_future = hash_futures.popleft()
+                yield media_path, creation_datetime, hash_future.result()
+        while len(hash_futures) > 0:
+            media_path, creation_datetime, hash_future = hash_futures.popleft()
+            yield media_path, creation_datetime, hash_future.result()
+
+
+def compute_hash(
+    media_path: pathlib.Path,
+    hash_cache: MutableMapping[str, str] | None = None,
+    partial_hash: bool = False,
+    legacy_hash: bool = False,
+) -> str:
+    """Compute hash of the contents of a media file.
+
+    :param media_path: Media path.
+    :param hash_cache: Cache of hashes as yielded by :func:`open_hash_cache`. If the hash of the
+    file is in the cache, it is returned without reading the file. Otherwise, the computed hash is
+    stored in the cache. If ``None``, the hash is always computed.
+    :param partial_hash: If ``True`` and the file is larger than ``PARTIAL_HASH_SIZE``, only the
+    first ``PARTIAL_HASH_SIZE`` bytes of the file are hashed, followed by the file size as 64-bit
+    little-endian integer, so that files with equal beginnings but different sizes still have
+    different hashes. Smaller files are hashed completely, so their hashes do not depend on
+    ``partial_hash``.
+    :param legacy_hash: If ``True``, the SHA256 hash is used as in earlier versions. Otherwise, the
+    XXH3 128-bit hash is used, which is much faster and sufficient to identify contents.
+    :return: First 8 hexadecimal digits of the hash of the contents of the media file.
+    """
+    if hash_cache is not None:
+        hash_cache_key = get_hash_cache_key(media_path)
+        if (hash_cache_value := hash_cache.get(hash_cache_key)) is not None:
+            cached_hash = hash_cache_value.rpartition("|")[2]
+            if hash_cache_value == get_hash_cache_value(media_path, cached_hash): return cached_hash
+    hash_ = hashlib.sha256() if legacy_hash else xxhash.xxh3_128()
+    with open(media_path, "rb", buffering=0) as file:
+        file_size = os.fstat(file.fileno()).st_size
+        remaining_size = min(file_size, PARTIAL_HASH_SIZE) if partial_hash else file_size
+        # Memory-mapping avoids copying the contents into Python objects. Small files cannot be
+        # memory-mapped efficiently, and memory-mapping files on network shares is unreliable on
+        # Windows.
+        if (sys.platform != "win32") and (remaining_size >= mmap.PAGESIZE):
+            with (
+                mmap.mmap(file.fileno(), remaining_size, access=mmap.ACCESS_READ) as memory_map,
+                memoryview(memory_map) as memory_view,
+            ):
+                for window_start in range(0, remaining_size, HASH_READAHEAD_SIZE):
+                    # Let the kernel read the next window while the current one is hashed, so that
+                    # I/O overlaps with hashing. The window is bounded, so that the workers do not
+                    # read ahead whole large files at once.
+                    window_end = window_start + HASH_READAHEAD_SIZE
+                    if hasattr(mmap, "MADV_WILLNEED") and (window_end < remaining_size):
+                        memory_map.madvise(
+                            mmap.MADV_WILLNEED,
+                            window_end,
+                            min(HASH_READAHEAD_SIZE, remaining_size - window_end),
+                        )
+                    hash_.update(memory_view[window_start:window_end])
+        else:
+            while (remaining_size > 0) and (
+                chunk := file.read(min(remaining_size, HASH_CHUNK_SIZE))
+            ):
+                hash_.update(chunk)
+                remaining_size -= len(chunk)
+    if partial_hash and (file_size > PARTIAL_HASH_SIZE):
+        hash_.update(file_size.to_bytes(8, "little"))
+    hash_string = hash_.digest()[:4].hex()
+    if hash_cache is not None:
+        hash_cache[hash_cache_key] = get_hash_cache_value(media_path, hash_string)
+    return hash_string
+
+
 def format_media_path(
     old_media_path: pathlib.Path,
     creation_datetime: datetime.datetime,
+    hash_: str,
 ) -> pathlib.Path:
     """Format renamed media path.
 
     :param old_media_path: Media path before renaming.
     :param creation_datetime: Creation datetime of media.
+    :param hash_: Hash of the contents of the media file as returned by :func:`compute_hash`.
     :return: Renamed media path. It has the same directory and suffix as ``old_media_path``, but
     ``YYYY-MM-DD_HH-MM-SS_HASH`` as stem, where the first part is the datetime in local time when
-    the media file was created, and ``HASH`` is the first 8 bytes of the SHA256 hash of the contents
-    of the media file.
+    the media file was created, and ``HASH`` is ``hash_``.
     """
-    hash_ = hashlib.sha256(old_media_path.read_bytes()).hexdigest()
     return old_media_path.with_name("{}_{}{}".format(
         creation_datetime.replace(tzinfo=None).isoformat(sep="_").replace(":", "-"),
-        hash_[:8],
+        hash_,
         old_media_path.suffix.lower(),
     ))
 
 
-def rename(rename_mapping: Mapping[pathlib.Path, pathlib.Path]) -> None:
+def rename(
+    rename_mapping: Mapping[pathlib.Path, pathlib.Path],
+    hash_cache: MutableMapping[str, str] | None = None,
+) -> None:
     """Rename files.
 
-    If a file already exists at a renamed path, the source file is removed. This is because the
-    renamed paths include the hash of the file, and therefore two files with the same renamed paths
-    can be assumed to be equal.
+    If a file already exists at a renamed path, the source file is removed if both files have the
+    same contents. As the renamed paths only include a truncated (and possibly partial) hash of the
+    file, the contents are compared completely, and the source file is kept if they differ.
 
     :param rename_mapping: Mapping from old media paths to renamed media paths.
+    :param hash_cache: Cache of hashes as yielded by :func:`open_hash_cache`. If not ``None``, the
+    hashes of renamed files are moved to their renamed paths in the cache.
     """
     print("Renaming {} file{}...".format(
         len(rename_mapping),
@@ -245,10 +634,91 @@ def rename(rename_mapping: Mapping[pathlib.Path, pathlib.Path]) -> None:
     ), file=sys.stderr)
 
     for old_path, new_path in rename_mapping.items():
-        if new_path.is_file():
-            old_path.unlink()
+        if hash_cache is not None: hash_cache.pop(get_hash_cache_key(old_path), None)
+        try:
+            rename_without_replacing(old_path, new_path)
+        except FileExistsError:
+            if filecmp.cmp(old_path, new_path, shallow=False):
+                old_path.unlink()
+            else:
+                print(
+                    f"`{new_path}` already exists, but differs in contents from `{old_path}`, "
+                    "skipping.",
+                    file=sys.stderr,
+                )
         else:
-            old_path.rename(new_path)
+            if hash_cache is not None:
+                hash_cache[get_hash_cache_key(new_path)] = get_hash_cache_value(
+                    new_path,
+                    new_path.stem.rpartition("_")[2],
+                )
+
+
+def rename_without_replacing(old_path: pathlib.Path, new_path: pathlib.Path) -> None:
+    """Rename a file, unless a file already exists at the new path.
+
+    On Linux, this is done atomically with a single ``renameat2`` system call with the
+    ``RENAME_NOREPLACE`` flag, if supported by the C library and the file system. On Windows,
+    ``os.rename`` never replaces existing files. Otherwise, the new path is checked before renaming.
+
+    :param old_path: Path of the file to rename.
+    :param new_path: Path to rename the file to.
+    :raises FileExistsError: If a file already exists at ``new_path``.
+    """
+    if sys.platform == "win32":
+        os.rename(old_path, new_path)
+        return
+    renameat2 = get_renameat2()
+    if renameat2 is not None:
+        if renameat2(
+            AT_FDCWD,
+            os.fsencode(old_path),
+            AT_FDCWD,
+            os.fsencode(new_path),
+            RENAME_NOREPLACE,
+        ) == 0:
+            return
+        error_number = ctypes.get_errno()
+        if error_number not in {errno.EINVAL, errno.ENOSYS}:
+            raise OSError(
+                error_number,
+                os.strerror(error_number),
+                str(old_path),
+                None,
+                str(new_path),
+            )
+    if new_path.is_file():
+        raise FileExistsError(
+            errno.EEXIST,
+            os.strerror(errno.EEXIST),
+            str(old_path),
+            None,
+            str(new_path),
+        )
+    os.rename(old_path, new_path)
+
+
+@functools.cache
+def get_renameat2() -> Callable[[int, bytes, int, bytes, int], int] | None:
+    """Get the ``renameat2`` function of the C library.
+
+    :return: ``renameat2`` function, or ``None`` if not on Linux or if the C library does not
+    provide it (e.g., glibc before 2.28).
+    """
+    if not sys.platform.startswith("linux"): return None
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (AttributeError, OSError):
+        return None
+    renameat2.argtypes = [
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_uint,
+    ]
+    renameat2.restype = ctypes.c_int
+    return renameat2
 
 
 if __name__ == "__main__": main()